@@ -2,36 +2,40 @@ import os
 import json
 from datetime import date, datetime
 from zoneinfo import ZoneInfo  # built-in in Python 3.9+
-from uploader import get_authenticated_service
+from uploader import (
+    get_authenticated_service, load_credentials, channel_file, record_usage, UPDATE_COST,
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
 PENDING_FILE = "pending_publish.txt"
 STATE_FILE = "publish_state.json"   # to track how many we published today
-DAILY_LIMIT = int(os.getenv("DAILY_LIMIT", 3))
+DAILY_LIMIT = int(os.getenv("DAILY_LIMIT", 3))  # per channel
 # Only publish at/after this hour (24h format, IST)
 PUBLISH_AFTER_HOUR_IST = 17  # 17 = 5 PM
 
 
-def load_state():
-    if not os.path.exists(STATE_FILE):
+def load_state(channel=None):
+    state_file = channel_file(STATE_FILE, channel)
+    if not os.path.exists(state_file):
         return {"date": None, "count": 0}
-    with open(STATE_FILE, "r") as f:
+    with open(state_file, "r") as f:
         return json.load(f)
 
 
-def save_state(state):
-    with open(STATE_FILE, "w") as f:
+def save_state(state, channel=None):
+    with open(channel_file(STATE_FILE, channel), "w") as f:
         json.dump(state, f)
 
 
-def publish(video_id: str):
-    youtube = get_authenticated_service()
+def publish(video_id: str, channel=None):
+    youtube = get_authenticated_service(channel)
     youtube.videos().update(
         part="status",
         body={"id": video_id, "status": {"privacyStatus": "public"}},
     ).execute()
+    record_usage(channel, UPDATE_COST)
     print(f"[PUBLISHED] {video_id}")
 
 
@@ -43,12 +47,18 @@ def iterate_publish_queue():
               f"Publishing allowed only after {PUBLISH_AFTER_HOUR_IST}:00.")
         return
 
-    if not os.path.exists(PENDING_FILE):
-        print("[INFO] No pending_publish.txt found.")
+    for cred in load_credentials():
+        publish_next(cred["name"])
+
+
+def publish_next(channel):
+    pending_file = channel_file(PENDING_FILE, channel)
+    if not os.path.exists(pending_file):
+        print(f"[INFO] [{channel}] No {pending_file} found.")
         return
 
     # 2) Load / reset daily state
-    state = load_state()
+    state = load_state(channel)
     today_str = date.today().isoformat()
 
     if state["date"] != today_str:
@@ -57,16 +67,16 @@ def iterate_publish_queue():
 
     remaining_quota = DAILY_LIMIT - state["count"]
     if remaining_quota <= 0:
-        print(f"[INFO] Daily limit of {DAILY_LIMIT} videos already reached.")
-        save_state(state)
+        print(f"[INFO] [{channel}] Daily limit of {DAILY_LIMIT} videos already reached.")
+        save_state(state, channel)
         return
 
     # 3) Read pending IDs
-    with open(PENDING_FILE, "r") as f:
+    with open(pending_file, "r") as f:
         lines = [line.strip() for line in f if line.strip()]
 
     if not lines:
-        print("[INFO] No video IDs in queue.")
+        print(f"[INFO] [{channel}] No video IDs in queue.")
         return
 
     # 4) Only publish ONE video per run (the first in queue)
@@ -74,28 +84,28 @@ def iterate_publish_queue():
     remaining = lines[1:]
 
     if remaining_quota <= 0:
-        print(f"[INFO] No remaining quota today. Skipping {video_id}.")
+        print(f"[INFO] [{channel}] No remaining quota today. Skipping {video_id}.")
         return
 
     try:
-        publish(video_id)
+        publish(video_id, channel)
         state["count"] += 1
-        print(f"[INFO] Today's publish count: {state['count']}/{DAILY_LIMIT}")
+        print(f"[INFO] [{channel}] Today's publish count: {state['count']}/{DAILY_LIMIT}")
 
         # Rewrite pending file without the published ID
-        with open(PENDING_FILE, "w") as f:
+        with open(pending_file, "w") as f:
             for vid in remaining:
                 f.write(vid + "\n")
 
     except Exception as e:
-        print(f"[ERROR] Failed to publish {video_id}: {e}")
+        print(f"[ERROR] [{channel}] Failed to publish {video_id}: {e}")
         # On failure, keep the queue unchanged so we can retry later
-        with open(PENDING_FILE, "w") as f:
+        with open(pending_file, "w") as f:
             for vid in lines:
                 f.write(vid + "\n")
 
     # 5) Save updated state
-    save_state(state)
+    save_state(state, channel)
 
 
 if __name__ == "__main__":
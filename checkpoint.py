@@ -0,0 +1,120 @@
+import os
+import json
+import uuid
+import hashlib
+from datetime import datetime
+
+JOBS_DIR = "jobs"   # one <job_id>.json checkpoint record per unfinished reel
+
+# Stage order; a restarted job continues from the first stage not recorded here
+STAGES = ["download", "modify", "metadata", "upload"]
+# Failed metadata/upload attempts before a job is given up on (restarts don't count)
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+
+def job_path(job_id):
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def save_job(job):
+    # Write to a temp file first so a crash mid-write never leaves a corrupt record
+    if not os.path.exists(JOBS_DIR):
+        os.makedirs(JOBS_DIR)
+    tmp_path = job_path(job["id"]) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, job_path(job["id"]))
+
+
+def create_job(url, chat_id):
+    job = {
+        "id": uuid.uuid4().hex,
+        "url": url,
+        "chat_id": chat_id,
+        "created": datetime.now().isoformat(),
+        "attempts": 0,
+        "stages": {},
+    }
+    save_job(job)
+    return job
+
+
+def unfinished_jobs():
+    """All checkpoint records left over from a previous run, oldest first."""
+    if not os.path.exists(JOBS_DIR):
+        return []
+
+    jobs = []
+    for name in os.listdir(JOBS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(JOBS_DIR, name), "r") as f:
+                jobs.append(json.load(f))
+        except Exception as e:
+            print(f"[WARN] Skipping unreadable job record {name}: {e}")
+    return sorted(jobs, key=lambda job: job.get("created", ""))
+
+
+def record_failure(job):
+    """Counts a failed metadata/upload attempt and persists it; returns the count."""
+    job["attempts"] = job.get("attempts", 0) + 1
+    save_job(job)
+    return job["attempts"]
+
+
+def complete_stage(job, stage, **outputs):
+    """
+    Records a stage's outputs and persists the job.
+    Any output ending in "path" also gets its file hash stored alongside it.
+    """
+    record = dict(outputs)
+    for key, value in outputs.items():
+        if key.endswith("path") and value and os.path.exists(value):
+            record[f"{key}_sha256"] = file_hash(value)
+    job["stages"][stage] = record
+    save_job(job)
+    return record
+
+
+def stage_output(job, stage):
+    """
+    Returns a completed stage's outputs, or None if the stage has to run again
+    (never completed, or one of its files is missing / no longer matches its hash).
+    """
+    record = job["stages"].get(stage)
+    if record is None:
+        return None
+
+    for key, value in record.items():
+        if not key.endswith("path") or not value:
+            continue
+        expected = record.get(f"{key}_sha256")
+        if not os.path.exists(value) or (expected and file_hash(value) != expected):
+            print(f"[WARN] Job {job['id']}: {stage} output {value} is missing or changed, redoing stage.")
+            return None
+    return record
+
+
+def finish_job(job):
+    """Removes the job's stage files and checkpoint record once it is done (or given up on)."""
+    paths = {
+        value
+        for record in job["stages"].values()
+        for key, value in record.items()
+        if key.endswith("path") and value
+    }
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    if os.path.exists(job_path(job["id"])):
+        os.remove(job_path(job["id"]))
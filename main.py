@@ -1,58 +1,150 @@
 import os
+import asyncio
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
-from metadata_gemini import generate_metadata, build_stats_context
+from metadata_gemini import MetadataBatcher
 # Import our custom modules
 import downloader
 import uploader
+import checkpoint
 from telegram.request import HTTPXRequest
 from modifier import make_video_unique
 
 load_dotenv()
 
+# Reels that arrive close together share one Gemini metadata request
+metadata_batcher = MetadataBatcher()
+# Concurrency caps: reels handled at once, and MoviePy encodes at once (CPU/RAM heavy)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 4))
+encode_slots = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_ENCODES", 2)))
+# Delay before a failed metadata/upload stage is retried
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", 600))
+# Keep references to resumed/retried jobs so they aren't garbage collected mid-run
+background_tasks = set()
+
+async def notify(bot, chat_id, text):
+    """Status message to the user; a Telegram hiccup must never abort a job."""
+    try:
+        await bot.send_message(chat_id=chat_id, text=text)
+    except Exception as e:
+        print(f"[WARN] Could not send Telegram message to {chat_id}: {e}")
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_url = update.message.text
     chat_id = update.effective_chat.id
 
     # 1. Validation
     if "instagram.com" not in user_url:
-        await context.bot.send_message(chat_id=chat_id, text="Please send a valid Instagram link.")
+        await notify(context.bot, chat_id, "Please send a valid Instagram link.")
         return
 
-    await context.bot.send_message(chat_id=chat_id, text="⬇️ Downloading Reel...")
+    job = checkpoint.create_job(user_url, chat_id)
+    await process_job(job, context.bot)
 
-    # 2. Download Phase
-    file_path_old, caption = downloader.download_instagram_reel(user_url)
 
-    if not file_path_old:
-        await context.bot.send_message(chat_id=chat_id, text="❌ Download failed.")
-        return
-    else:
-        await context.bot.send_message(chat_id=chat_id, text="🎬 Modifying video to ensure uniqueness...")
-    file_path = make_video_unique(file_path_old)
+async def process_job(job, bot):
+    """
+    Runs a reel through download -> modify -> metadata -> upload.
+    Each stage's outputs are checkpointed, so a restarted job skips every stage
+    that already completed. A failed metadata/upload stage is retried in-process
+    after JOB_RETRY_DELAY seconds, up to MAX_ATTEMPTS failures.
+    """
+    user_url = job["url"]
+    chat_id = job["chat_id"]
 
-    if not file_path:
-        await context.bot.send_message(chat_id=chat_id, text="❌ Video modification failed, using original video for upload.")
-        file_path = file_path_old  # Fallback to original
+    uploaded = checkpoint.stage_output(job, "upload")
+    if not uploaded:
+        # 2. Download + Modify Phase (skipped if the processed file survived a restart)
+        # Hashing whole videos is slow, so checkpoint file stages run in worker threads
+        modified = await asyncio.to_thread(checkpoint.stage_output, job, "modify")
+        if not modified:
+            downloaded = await asyncio.to_thread(checkpoint.stage_output, job, "download")
+            if not downloaded:
+                await notify(bot, chat_id, "⬇️ Downloading Reel...")
+                file_path_old, caption = await asyncio.to_thread(downloader.download_instagram_reel, user_url)
 
+                if not file_path_old:
+                    await notify(bot, chat_id, "❌ Download failed.")
+                    checkpoint.finish_job(job)
+                    return
+                downloaded = await asyncio.to_thread(checkpoint.complete_stage, job, "download", path=file_path_old, caption=caption)
 
-    await context.bot.send_message(chat_id=chat_id, text="⬆️ Uploading to YouTube...")
+            await notify(bot, chat_id, "🎬 Modifying video to ensure uniqueness...")
+            async with encode_slots:
+                file_path = await asyncio.to_thread(make_video_unique, downloaded["path"])
+
+            if not file_path:
+                await notify(bot, chat_id, "❌ Video modification failed, using original video for upload.")
+                file_path = downloaded["path"]  # Fallback to original
+            modified = await asyncio.to_thread(checkpoint.complete_stage, job, "modify", path=file_path)
+
+        file_path = modified["path"]
+        caption = job["stages"]["download"]["caption"]
+
+        await notify(bot, chat_id, "⬆️ Uploading to YouTube...")
+
+        # 3. Upload Phase
+        reserved = None   # channel whose upload cost this run holds
+        try:
+            generated = checkpoint.stage_output(job, "metadata")
+            routed = checkpoint.stage_output(job, "route")
+            if generated and routed:
+                # Metadata was written for this channel's audience, so stay on it,
+                # but only send the upload if its project can still afford it
+                channel = routed["channel"]
+                uploader.reserve_upload(channel)
+            else:
+                channel = uploader.pick_channel()
+                checkpoint.complete_stage(job, "route", channel=channel)
+            reserved = channel
+
+            if not generated:
+                metadata = await metadata_batcher.submit(caption=caption, url=user_url, video_path=file_path, channel=channel)
+                generated = checkpoint.complete_stage(job, "metadata", metadata=metadata)
+            metadata = generated["metadata"]
+            print("Generated Metadata:", metadata)
+
+            reserved = None   # upload_video charges or releases it from here on
+            video_id = await asyncio.to_thread(uploader.upload_video, file_path, title=(metadata["title"] or caption), description=(metadata["description"] or f"Original: {user_url}"), tags=metadata.get("tags", []), channel=channel)
+            uploaded = checkpoint.complete_stage(job, "upload", video_id=video_id, channel=channel)
+        except Exception as e:
+            if reserved:
+                uploader.release_upload(reserved)
+            attempts = checkpoint.record_failure(job)
+            if attempts >= checkpoint.MAX_ATTEMPTS:
+                await notify(bot, chat_id, f"❌ Upload failed: {str(e)}\nGiving up after {attempts} attempts.")
+                checkpoint.finish_job(job)
+            else:
+                # Keep the checkpoint and files; the retry skips completed stages
+                await notify(bot, chat_id, f"❌ Upload failed: {str(e)}\nRetrying in {JOB_RETRY_DELAY}s (attempt {attempts}/{checkpoint.MAX_ATTEMPTS}).")
+                run_in_background(retry_job(job, bot))
+            return
+
+    youtube_link = f"https://youtube.com/shorts/{uploaded['video_id']}"
+    await notify(bot, chat_id, f"✅ Success! View here: {youtube_link}")
+    checkpoint.finish_job(job)
+
+
+async def retry_job(job, bot):
+    await asyncio.sleep(JOB_RETRY_DELAY)
+    await process_job(job, bot)
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def resume_jobs(app):
+    """Picks up jobs that were interrupted by a crash or restart."""
+    for job in checkpoint.unfinished_jobs():
+        done = ", ".join(job["stages"]) or "none"
+        print(f"Resuming job {job['id']} for {job['url']} (completed stages: {done})")
+        run_in_background(process_job(job, app.bot))
 
-    # 3. Upload Phase
-    try:
-        stats_context = build_stats_context()
-        print("Stats Context:", stats_context)
-        metadata = generate_metadata(caption=caption, url=user_url, video_path=file_path, stats_context=stats_context)
-        print("Generated Metadata:", metadata)
-        video_id = uploader.upload_video(file_path, title=(metadata["title"] or caption), description=(metadata["description"] or f"Original: {user_url}"), tags=metadata.get("tags", []))
-        youtube_link = f"https://youtube.com/shorts/{video_id}"
-        await context.bot.send_message(chat_id=chat_id, text=f"✅ Success! View here: {youtube_link}")
-    except Exception as e:
-        await context.bot.send_message(chat_id=chat_id, text=f"❌ Upload failed: {str(e)}")
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 if __name__ == '__main__':
     # Start the bot
@@ -61,8 +153,9 @@ if __name__ == '__main__':
     read_timeout=20.0,
     write_timeout=20.0,
     pool_timeout=5.0,
+    connection_pool_size=MAX_CONCURRENT_JOBS + 1,  # one per concurrent job + spare
 )
-    app = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN")).request(request).build()
+    app = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN")).request(request).concurrent_updates(MAX_CONCURRENT_JOBS).post_init(resume_jobs).build()
     
     # Listen for text messages
     msg_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message)
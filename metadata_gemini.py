@@ -1,12 +1,13 @@
 import os
 import json
 import google.generativeai as genai
-from uploader import get_authenticated_service
+from uploader import get_authenticated_service, record_usage, SEARCH_COST, LIST_COST
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
-import re
+import asyncio
 import time
+import uuid
 load_dotenv()
 # ---------- CONFIG ----------
 
@@ -20,24 +21,25 @@ YOUTUBE_API_VERSION = "v3"
 
 
 # ---------- YOUTUBE STATS CONTEXT ----------
-youtube = get_authenticated_service()
-
-def get_channel_id():
-    """Get current authenticated channel's ID."""
+def get_channel_id(youtube, channel=None):
+    """Get the given channel's ID (first configured channel by default)."""
     resp = youtube.channels().list(part="id", mine=True).execute()
+    record_usage(channel, LIST_COST)
     items = resp.get("items", [])
     if not items:
         return None
     return items[0]["id"]
 
 
-def build_stats_context(max_videos=8):
+def build_stats_context(max_videos=8, channel=None):
     """
     Fetch a few recent videos + stats and build a compact text summary
     to feed into Gemini so it learns what works on your channel.
     """
     try:
-        channel_id = get_channel_id()
+        # Fresh client per call: httplib2 isn't thread-safe and batches run in worker threads
+        youtube = get_authenticated_service(channel)
+        channel_id = get_channel_id(youtube, channel)
         if not channel_id:
             return ""
 
@@ -48,6 +50,7 @@ def build_stats_context(max_videos=8):
             type="video",
             maxResults=max_videos,
         ).execute()
+        record_usage(channel, SEARCH_COST)
 
         video_ids = [
             item["id"]["videoId"]
@@ -62,6 +65,7 @@ def build_stats_context(max_videos=8):
             part="snippet,statistics",
             id=",".join(video_ids),
         ).execute()
+        record_usage(channel, LIST_COST)
 
         lines = []
         for item in stats_resp.get("items", []):
@@ -118,19 +122,34 @@ def upload_video_to_gemini(video_path):
     return video_file
 
 # ---------- GEMINI METADATA GENERATION ----------
-def generate_metadata(caption: str, url, video_path: str, stats_context: str = ""):
-    """
-    Generates viral-optimized YouTube Shorts metadata using Gemini.
-    Uses YouTube stats context (if provided) to adapt style.
-    Returns dict: title, description, tags, hashtags.
-    """
-
-    video_file = upload_video_to_gemini(video_path)
-
-
-    prompt = f"""
-    You are a YouTube Shorts viral strategist. See the caption of the video and recent stats and generate high-CTR metadata.
-    Output a JSON object with these exact keys:
+# Batch mode: jobs queued within this window share one Gemini request
+BATCH_WINDOW = float(os.getenv("METADATA_BATCH_WINDOW", 10))
+BATCH_MAX_SIZE = int(os.getenv("METADATA_BATCH_MAX_SIZE", 8))
+BATCH_MAX_RETRIES = 2
+
+# Strict output schema: a keyed array, one metadata object per video
+METADATA_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "STRING"},
+            "title": {"type": "STRING"},
+            "description": {"type": "STRING"},
+            "tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "hashtags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "required": ["id", "title", "description", "tags", "hashtags"],
+    },
+}
+
+
+def build_prompt(stats_context: str = ""):
+    """Shared instructions, sent once per batch."""
+    return f"""
+    You are a YouTube Shorts viral strategist. For EACH video below, see its caption and my recent stats and generate high-CTR metadata.
+    For each video output an object with these exact keys:
+        0. "id": The video ID given in the VIDEO header, copied exactly.
         1. "title": A curiosity-gap title (max 60 chars). NO generic titles like "Funny Cat".
         2. "description": A detailed description atleast 20 lines. 
            Line 1: Describe the hook. 
@@ -144,10 +163,7 @@ CHANNEL STATS CONTEXT (may be empty):
 {stats_context}
 
 TASK:
-Generate highly clickable metadata for a YouTube SHORT.
-
-INPUT CAPTION:
-{caption}
+Generate highly clickable metadata for each YouTube SHORT listed after these rules.
 
 RULES FOR OUTPUT:
 1) TITLE:
@@ -172,55 +188,185 @@ RULES FOR OUTPUT:
    - Include #shorts and niche tags
    - 5–10 hashtags total
 
-Return ONLY valid JSON:
-{{
-  "title": "...",
-  "description": "...",
-  "tags": ["..."],
-  "hashtags": ["..."]
-}}
+Return a JSON array with exactly one object per video.
 """
-    content_payload = [prompt]
 
-    if video_file:
-        print("Attaching video file to Gemini prompt for analysis...")
-        content_payload.append(video_file)
 
+def fallback_metadata(caption: str, url):
+    return {
+        "title": caption[:60] or "Amazing Short Video",
+        "description": caption + "\n\n#shorts" + f"\nCredit: {url}",
+        "tags": ["shorts"],
+        "hashtags": ["#shorts"],
+    }
+
+
+def is_valid_metadata(item):
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("title"), str) and item["title"].strip()
+        and isinstance(item.get("description"), str)
+        and isinstance(item.get("tags"), list)
+        and isinstance(item.get("hashtags"), list)
+    )
 
-    response = genai.GenerativeModel(GEMINI_MODEL).generate_content(contents=content_payload)
-    raw = (response.text or "").strip()
 
-     # 1) Try direct JSON first
-    try:
-        return json.loads(raw)
-    except:
-        pass
+def generate_metadata_batch(jobs, stats_context: str = ""):
+    """
+    Generates metadata for several videos in one Gemini request.
+    jobs: list of dicts with id, caption, url, video_path.
+    Returns dict: job id -> metadata dict (title, description, tags, hashtags).
+    Items missing from or malformed in the response are retried on their own;
+    after BATCH_MAX_RETRIES they get fallback metadata.
+    If the request itself keeps failing (429, 5xx, timeouts), the jobs still
+    pending are left out of the result so callers can fail them instead.
+    """
+    # Upload each video once; retries reuse the same Gemini file.
+    # A failed upload only affects its own job, which is then sent caption-only.
+    video_files = {}
+    for job in jobs:
+        try:
+            video_files[job["id"]] = upload_video_to_gemini(job["video_path"])
+        except Exception as e:
+            print(f"Gemini upload failed for video {job['id']}, using caption only: {e}")
+            video_files[job["id"]] = None
+
+    model = genai.GenerativeModel(
+        GEMINI_MODEL,
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=METADATA_SCHEMA,
+        ),
+    )
+
+    results = {}
+    pending = list(jobs)
+    parse_retry = 0
+    request_retry = 0
+
+    while pending:
+        content_payload = [build_prompt(stats_context)]
+        for job in pending:
+            content_payload.append(f"VIDEO id={job['id']}\nINPUT CAPTION:\n{job['caption']}")
+            if video_files[job["id"]]:
+                content_payload.append(video_files[job["id"]])
 
-    # 2) Try to extract using regex for ```json ... ```
-    codeblock = re.search(r"```json\n([\s\S]*?)```", raw, re.IGNORECASE)
-    if codeblock:
         try:
-            return json.loads(codeblock.group(1))
-        except:
-            pass
+            response = model.generate_content(contents=content_payload)
+            raw = (response.text or "").strip()
+        except Exception as e:
+            request_retry += 1
+            if request_retry > BATCH_MAX_RETRIES:
+                print(f"FAILED: Gemini request failed after {BATCH_MAX_RETRIES} retries. Last error: {e}")
+                return results
+
+            sleep_time = 2 ** request_retry  # exponential backoff: 2,4,8,...
+            print(f"WARNING: Gemini request failed: {e}. Retrying #{request_retry} in {sleep_time} seconds...")
+            time.sleep(sleep_time)
+            continue
 
-    # 3) Try extracting any JSON-like block (braces)
-    brace = re.search(r"(\{[\s\S]*\})", raw)
-    if brace:
         try:
-            return json.loads(brace.group(1))
-        except:
-            pass
+            items = json.loads(raw)
+        except Exception as e:
+            print(f"Could not parse Gemini response: {e}")
+            print("Raw response was:", raw)
+            items = []
 
-    
-    print("Raw response was:", raw)
-        # Fallback in case model adds explanation text
-    return {
-            "title": caption[:60] or "Amazing Short Video",
-            "description": caption + "\n\n#shorts" + f"\nCredit: {url}",
-            "tags": ["shorts"],
-            "hashtags": ["#shorts"],
-        }
+        for item in items if isinstance(items, list) else []:
+            if is_valid_metadata(item) and item.get("id") in video_files:
+                results[item["id"]] = {key: item[key] for key in ("title", "description", "tags", "hashtags")}
+
+        pending = [job for job in pending if job["id"] not in results]
+        if not pending or parse_retry >= BATCH_MAX_RETRIES:
+            break
+        parse_retry += 1
+        print(f"Retrying metadata for {len(pending)} video(s), attempt #{parse_retry}...")
+
+    for job in pending:
+        print(f"Using fallback metadata for video {job['id']}")
+        results[job["id"]] = fallback_metadata(job["caption"], job["url"])
+
+    return results
+
+
+def generate_metadata(caption: str, url, video_path: str, stats_context: str = ""):
+    """
+    Generates viral-optimized YouTube Shorts metadata using Gemini.
+    Uses YouTube stats context (if provided) to adapt style.
+    Returns dict: title, description, tags, hashtags.
+    """
+    job = {"id": "0", "caption": caption, "url": url, "video_path": video_path}
+    results = generate_metadata_batch([job], stats_context)
+    if "0" not in results:
+        raise RuntimeError("Gemini metadata request failed")
+    return results["0"]
+
+
+class MetadataBatcher:
+    """
+    Collects metadata jobs for BATCH_WINDOW seconds (or until BATCH_MAX_SIZE)
+    and resolves them with one Gemini request per channel.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_size=BATCH_MAX_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []   # (job, channel, future)
+        self._timer = None
+        self._tasks = set()  # keep running batches referenced so they aren't garbage collected
+
+    async def submit(self, caption: str, url, video_path: str, channel=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = {"id": uuid.uuid4().hex[:8], "caption": caption, "url": url, "video_path": video_path}
+        self._pending.append((job, channel, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        by_channel = {}
+        for job, channel, future in batch:
+            by_channel.setdefault(channel, []).append((job, future))
+
+        for channel, entries in by_channel.items():
+            jobs = [job for job, _ in entries]
+            print(f"Generating metadata for {len(jobs)} video(s) in one request (channel: {channel})")
+            try:
+                results = await asyncio.to_thread(self._generate, jobs, channel)
+            except Exception as e:
+                for _, future in entries:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for job, future in entries:
+                if future.done():
+                    continue
+                if job["id"] in results:
+                    future.set_result(results[job["id"]])
+                else:
+                    future.set_exception(RuntimeError("Gemini metadata request failed"))
+
+    @staticmethod
+    def _generate(jobs, channel):
+        # Stats context is built once per batch instead of once per video
+        stats_context = build_stats_context(channel=channel)
+        print("Stats Context:", stats_context)
+        return generate_metadata_batch(jobs, stats_context)
 
 
 if __name__ == "__main__":
@@ -67,7 +67,7 @@ def make_video_unique(input_path):
             output_path, 
             codec='libx264', 
             audio_codec='aac', 
-            temp_audiofile='temp-audio.m4a', 
+            temp_audiofile=f"temp-audio-{uuid.uuid4()}.m4a",  # unique so concurrent jobs don't clash
             remove_temp=True, # Set to None to keep console clean, or 'bar' for progress bar
         )
         
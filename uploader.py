@@ -7,20 +7,235 @@ from googleapiclient.errors import HttpError
 import socket
 import os
 import time
+import json
 import pickle
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+try:
+    import fcntl  # POSIX only; elsewhere we fall back to the in-process lock
+except ImportError:
+    fcntl = None
 
 SCOPES = ['https://www.googleapis.com/auth/youtube', 'https://www.googleapis.com/auth/yt-analytics.readonly']
 
+# Pool of credential sets (separate OAuth projects and/or target channels).
+# credentials.json is a list like:
+#   [{"name": "main", "token_file": "token.pickle", "client_secrets": "client_secrets.json"},
+#    {"name": "alt", "token_file": "token_alt.pickle", "client_secrets": "client_secrets_alt.json",
+#     "daily_quota": 10000}]
+# If the file is missing we fall back to the single token.pickle / client_secrets.json setup.
+# Quota belongs to the OAuth project, so channels sharing a client_secrets file share one budget.
+CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE", "credentials.json")
+QUOTA_FILE = "quota_state.json"     # units spent today, per OAuth project (client_secrets file)
+DEFAULT_CHANNEL = "default"
+DEFAULT_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", 10000))
+
+# YouTube Data API unit costs
+UPLOAD_COST = 1600
+UPDATE_COST = 50
+SEARCH_COST = 100
+LIST_COST = 1
+
+_quota_lock = threading.RLock()   # jobs run in worker threads
+_quota_lock_depth = 0
+# Upload cost held for jobs routed but not yet sent, per project. Kept in memory only:
+# it is not spend, so it must not outlive this process.
+_reserved = {}
+
+
+def load_credentials():
+    """Returns the configured credential sets, one dict per channel."""
+    if not os.path.exists(CREDENTIALS_FILE):
+        return [{
+            "name": DEFAULT_CHANNEL,
+            "token_file": "token.pickle",
+            "client_secrets": "client_secrets.json",
+            "daily_quota": DEFAULT_DAILY_QUOTA,
+        }]
+
+    with open(CREDENTIALS_FILE, "r") as f:
+        entries = json.load(f)
+
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{CREDENTIALS_FILE} must be a non-empty list of credential sets")
+
+    credentials = []
+    project_quotas = {}
+    for entry in entries:
+        name = entry["name"]
+        cred = {
+            "name": name,
+            "token_file": entry.get("token_file", f"token_{name}.pickle"),
+            "client_secrets": entry.get("client_secrets", "client_secrets.json"),
+            "daily_quota": int(entry.get("daily_quota", DEFAULT_DAILY_QUOTA)),
+        }
+        if any(other["name"] == name for other in credentials):
+            raise ValueError(f"{CREDENTIALS_FILE}: duplicate channel name {name!r}")
+        project = cred["client_secrets"]
+        if project_quotas.setdefault(project, cred["daily_quota"]) != cred["daily_quota"]:
+            raise ValueError(f"{CREDENTIALS_FILE}: project {project!r} is listed with different daily_quota values")
+        credentials.append(cred)
+    return credentials
+
+
+def get_credential(channel=None):
+    """Looks up a credential set by name (first one if channel is None)."""
+    credentials = load_credentials()
+    if channel is None:
+        return credentials[0]
+    for cred in credentials:
+        if cred["name"] == channel:
+            return cred
+    raise ValueError(f"Unknown channel: {channel}")
+
+
+def channel_file(path, channel=None):
+    """
+    Per-channel variant of a state file: pending_publish.txt -> pending_publish_alt.txt.
+    Only the single-credential fallback (no credentials.json) keeps the original name,
+    so reordering credentials.json never moves one channel's queue to another.
+    """
+    if not os.path.exists(CREDENTIALS_FILE):
+        return path
+    first = get_credential()["name"]
+    channel = channel or first
+    base, ext = os.path.splitext(path)
+    suffixed = f"{base}_{channel}{ext}"
+
+    # Files from before credentials.json existed belong to the first channel
+    if channel == first and os.path.exists(path):
+        if not os.path.exists(suffixed):
+            os.replace(path, suffixed)
+            print(f"[INFO] Migrated legacy {path} to {suffixed}")
+        else:
+            print(f"[WARN] Legacy {path} is ignored because {suffixed} exists; merge it by hand.")
+    return suffixed
+
+
+# ---------- QUOTA TRACKING ----------
+def quota_day():
+    # YouTube quota resets at midnight Pacific Time
+    return datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+
+
+@contextmanager
+def quota_lock():
+    """
+    Serialises quota read-modify-writes across threads and, via a file lock,
+    across processes (auto_publish.py updates the same file). Re-entrant.
+    """
+    global _quota_lock_depth
+    with _quota_lock:
+        lock_file = None
+        if _quota_lock_depth == 0 and fcntl is not None:
+            lock_file = open(QUOTA_FILE + ".lock", "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _quota_lock_depth += 1
+        try:
+            yield
+        finally:
+            _quota_lock_depth -= 1
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
 
-def get_authenticated_service():
+def load_quota():
+    with quota_lock():
+        if not os.path.exists(QUOTA_FILE):
+            return {}
+        with open(QUOTA_FILE, "r") as f:
+            return json.load(f)
+
+
+def save_quota(quota):
+    # Write to a temp file first so readers (incl. auto_publish.py) never see a half-written file
+    with quota_lock():
+        tmp_path = f"{QUOTA_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(quota, f)
+        os.replace(tmp_path, QUOTA_FILE)
+
+
+def record_usage(channel, units):
+    """Adds units to today's spend for the channel's OAuth project."""
+    project = get_credential(channel)["client_secrets"]
+    with quota_lock():
+        quota = load_quota()
+        today = quota_day()
+        entry = quota.get(project)
+        if not entry or entry.get("date") != today:
+            entry = {"date": today, "used": 0}
+        entry["used"] += units
+        quota[project] = entry
+        save_quota(quota)
+
+
+def remaining_quota(channel=None):
+    """Units left today for the channel's OAuth project, minus pending reservations."""
+    cred = get_credential(channel)
+    project = cred["client_secrets"]
+    with quota_lock():
+        entry = load_quota().get(project)
+        used = entry["used"] if entry and entry.get("date") == quota_day() else 0
+        return cred["daily_quota"] - used - _reserved.get(project, 0)
+
+
+def reserve_upload(channel):
+    """
+    Holds the upload cost on a channel's project until the upload is sent
+    (charge_upload) or abandoned (release_upload).
+    Raises RuntimeError if the project can't afford it.
+    """
+    project = get_credential(channel)["client_secrets"]
+    with quota_lock():
+        if remaining_quota(channel) < UPLOAD_COST:
+            raise RuntimeError(f"Channel {channel} has less than {UPLOAD_COST} quota units left today.")
+        _reserved[project] = _reserved.get(project, 0) + UPLOAD_COST
+
+
+def release_upload(channel):
+    """Gives back a reservation for an upload that was never sent."""
+    project = get_credential(channel)["client_secrets"]
+    with quota_lock():
+        _reserved[project] = max(0, _reserved.get(project, 0) - UPLOAD_COST)
+
+
+def charge_upload(channel):
+    """Turns a reservation into actual spend; called right before the insert is sent."""
+    with quota_lock():
+        release_upload(channel)
+        record_usage(channel, UPLOAD_COST)
+
+
+def pick_channel():
+    """
+    Routes a job to the credential set with the most remaining budget and
+    reserves the upload cost right away, so concurrent jobs spread across channels.
+    Raises RuntimeError if no project can afford an upload today.
+    """
+    with quota_lock():
+        best = max(load_credentials(), key=lambda cred: remaining_quota(cred["name"]))
+        if remaining_quota(best["name"]) < UPLOAD_COST:
+            raise RuntimeError(f"No channel has {UPLOAD_COST} quota units left today. Try again after the daily reset.")
+        reserve_upload(best["name"])
+    return best["name"]
+
+
+def get_authenticated_service(channel=None):
     """
     Handles OAuth2 refresh tokens so the bot runs 24/7 without you logging in.
-    First run requires manual browser login; subsequent runs use token.pickle.
+    First run requires manual browser login; subsequent runs use the channel's token file.
     """
+    cred = get_credential(channel)
+    token_file = cred["token_file"]
     creds = None
 
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
+    if os.path.exists(token_file):
+        with open(token_file, 'rb') as token:
             creds = pickle.load(token)
 
     if not creds or not creds.valid:
@@ -30,46 +245,56 @@ def get_authenticated_service():
         else:
             # FIRST TIME ONLY: this opens a browser locally.
             flow = InstalledAppFlow.from_client_secrets_file(
-                'client_secrets.json', SCOPES
+                cred["client_secrets"], SCOPES
             )
             creds = flow.run_local_server(port=0)
 
-        with open('token.pickle', 'wb') as token:
+        with open(token_file, 'wb') as token:
             pickle.dump(creds, token)
 
-    # On EC2: make sure token.pickle + client_secrets.json exist
+    # On EC2: make sure the token + client secrets files exist
     return build('youtube', 'v3', credentials=creds)
     # (if you ever hit discovery cache issues, add cache_discovery=False)
 
 
-def upload_video(file_path, title, description, tags, max_retries=5):
-    youtube = get_authenticated_service()
-
-    body = {
-        'snippet': {
-            'title': title[:100],  # YouTube limit
-            'description': (description or '') + "\n\n#shorts",
-            'categoryId': '24',
-            'tags': tags,
-        },
-        'status': {
-            'privacyStatus': 'private',  # Start private to check for copyright
-            'selfDeclaredMadeForKids': False,
-        },
-    }
-
-    # 1 MB chunks are OK; you can try 2–8 MB if your network is stable
-    media = MediaFileUpload(
-        file_path,
-        chunksize=1024 * 1024,
-        resumable=True,
-    )
-
-    request = youtube.videos().insert(
-        part=",".join(body.keys()),
-        body=body,
-        media_body=media,
-    )
+def upload_video(file_path, title, description, tags, max_retries=5, channel=None):
+    # channel should come from pick_channel() / reserve_upload(), which hold the upload cost
+    channel = channel or pick_channel()
+    try:
+        youtube = get_authenticated_service(channel)
+
+        body = {
+            'snippet': {
+                'title': title[:100],  # YouTube limit
+                'description': (description or '') + "\n\n#shorts",
+                'categoryId': '24',
+                'tags': tags,
+            },
+            'status': {
+                'privacyStatus': 'private',  # Start private to check for copyright
+                'selfDeclaredMadeForKids': False,
+            },
+        }
+
+        # 1 MB chunks are OK; you can try 2–8 MB if your network is stable
+        media = MediaFileUpload(
+            file_path,
+            chunksize=1024 * 1024,
+            resumable=True,
+        )
+
+        request = youtube.videos().insert(
+            part=",".join(body.keys()),
+            body=body,
+            media_body=media,
+        )
+    except Exception:
+        # Nothing was sent to YouTube, so give the reservation back
+        release_upload(channel)
+        raise
+
+    # The insert goes out with the first chunk: from here on the units are spent
+    charge_upload(channel)
 
     response = None
     error = None
@@ -107,13 +332,14 @@ def upload_video(file_path, title, description, tags, max_retries=5):
     video_id = response["id"]
 
     # Save schedule info
-    with open("pending_publish.txt", "a") as f:
+    with open(channel_file("pending_publish.txt", channel), "a") as f:
         f.write(f"{video_id}\n")
-    print("Upload complete. Video ID:", video_id)
+    print(f"Upload complete. Video ID: {video_id} (channel: {channel})")
     
     return video_id
 
 
 if __name__ == '__main__':
-    # Just tests auth; comment out on EC2 once token.pickle is generated locally
-    get_authenticated_service()
+    # Just tests auth; comment out on EC2 once the token files are generated locally
+    for cred in load_credentials():
+        get_authenticated_service(cred["name"])